@@ -8,8 +8,20 @@ import argparse
 import shutil
 from pathlib import Path
 
-from build_images import process_images
-from build_site import process_manifests, generate_index
+from build_images import (
+    add_limit_arguments,
+    image_sources,
+    limits_from_args,
+    process_images,
+)
+from build_inventory import BuildInventory, add_previous_argument, previous_from_args
+from build_site import (
+    INDEX_PAGE_SIZE,
+    generate_index,
+    manifest_sources,
+    process_manifests,
+)
+from fetch_images import add_fetch_arguments, fetch_options_from_args
 
 
 def clean_site_dir(site_dir):
@@ -30,14 +42,43 @@ def main():
         "--src-images", default="src_images", help="Source images directory"
     )
     parser.add_argument("--templates", default="templates", help="Templates directory")
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=INDEX_PAGE_SIZE,
+        help="Manifests per category page",
+    )
+    add_previous_argument(parser)
+    add_limit_arguments(parser)
+    add_fetch_arguments(parser)
     args = parser.parse_args()
 
     base_url = args.url.rstrip("/")
 
+    # Read the previous inventory before the site directory is cleaned
+    previous = previous_from_args(args)
+
     clean_site_dir(args.dest)
-    process_images(args.src_images, args.dest, base_url)
-    manifests = process_manifests(args.dest, base_url)
-    generate_index(manifests, args.dest, args.templates, base_url)
+    inventory = BuildInventory(args.dest, base_url)
+
+    with inventory.stage("images", [args.src_images]):
+        process_images(
+            args.src_images,
+            args.dest,
+            base_url,
+            limits_from_args(args),
+            fetch_options_from_args(args),
+        )
+    inventory.add_sources(image_sources(args.src_images))
+
+    with inventory.stage("manifests", ["manifests"]):
+        manifests = process_manifests(args.dest, base_url)
+    inventory.add_sources(manifest_sources())
+
+    with inventory.stage("index", [args.templates]):
+        generate_index(manifests, args.dest, args.templates, base_url, args.page_size)
+
+    inventory.write(previous)
 
     print("Build complete.")
 
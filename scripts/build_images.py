@@ -8,42 +8,189 @@ import argparse
 import json
 import shutil
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from build_inventory import BuildInventory, add_previous_argument, previous_from_args
+from fetch_images import (
+    add_fetch_arguments,
+    fetch_options_from_args,
+    fetch_source_images,
+    load_descriptors,
+)
+
 # Thumbnail size for viewer previews
 THUMBNAIL_SIZE = 400
 
+MB = 1024 * 1024
+
+# Default resource limits for the image stage
+DEFAULT_JOBS = 1
+DEFAULT_MEMORY_BUDGET_MB = 1024
+DEFAULT_VIPS_CONCURRENCY = 2
+DEFAULT_VIPS_CACHE_MB = 64
+
+# Images whose decoded size exceeds this are streamed with sequential access
+# instead of being fully decoded for random access
+RANDOM_ACCESS_MAX_MB = 256
+
+# Fixed per-process overhead for a vips job
+VIPS_BASE_MEMORY_MB = 32
+
+# Rows of pixels each vips worker keeps in flight when streaming
+SEQUENTIAL_WINDOW_ROWS = 1024
+
+# Bytes per band for each vips band format
+BAND_FORMAT_BYTES = {
+    "uchar": 1,
+    "char": 1,
+    "ushort": 2,
+    "short": 2,
+    "uint": 4,
+    "int": 4,
+    "float": 4,
+    "complex": 8,
+    "double": 8,
+    "dpcomplex": 16,
+}
+
 
 def check_vips_installed():
     """Check if vips is available in the system path."""
     return shutil.which("vips") is not None
 
 
-def get_image_dimensions(img_path):
-    """Get the width and height of an image using vips."""
+def get_image_header(img_path):
+    """Get the width, height, bands and band format of an image using vipsheader.
+
+    Only the image header is read, in a single vipsheader call, so this is
+    cheap even for gigapixel sources.
+
+    Returns:
+        Dict with width, height, bands and format, or None if unreadable.
+    """
     try:
         result = subprocess.run(
-            ["vipsheader", "-f", "width", str(img_path)],
+            ["vipsheader", "-a", str(img_path)],
             capture_output=True,
             text=True,
             check=True,
         )
-        width = int(result.stdout.strip())
+    except subprocess.CalledProcessError:
+        return None
 
-        result = subprocess.run(
-            ["vipsheader", "-f", "height", str(img_path)],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        height = int(result.stdout.strip())
+    # Output is one "field: value" line per header field
+    fields = {}
+    for line in result.stdout.splitlines():
+        name, sep, value = line.partition(": ")
+        if sep:
+            fields.setdefault(name.strip(), value.strip())
+
+    try:
+        return {
+            "width": int(fields["width"]),
+            "height": int(fields["height"]),
+            "bands": int(fields["bands"]),
+            "format": fields["format"],
+        }
+    except (KeyError, ValueError):
+        return None
 
-        return width, height
-    except subprocess.CalledProcessError:
-        return None, None
 
+def choose_access(header):
+    """Choose the vips access strategy for tiling an image.
 
-def generate_thumbnail(img_file, img_out_dir, orig_width, orig_height):
+    Small images are decoded once for random access. Large images are
+    streamed top-to-bottom with sequential access so the whole decoded
+    image never has to be held in memory.
+    """
+    if header is None:
+        return "sequential"
+    if decoded_size(header) > RANDOM_ACCESS_MAX_MB * MB:
+        return "sequential"
+    return "random"
+
+
+def decoded_size(header):
+    """Get the size in bytes of an image once fully decoded."""
+    pixel_bytes = header["bands"] * BAND_FORMAT_BYTES.get(header["format"], 1)
+    return header["width"] * header["height"] * pixel_bytes
+
+
+def estimate_job_memory(header, access, limits):
+    """Estimate the peak memory in bytes of tiling a single image.
+
+    Args:
+        header: Image header from get_image_header (or None if unknown)
+        access: Access strategy from choose_access
+        limits: Resource limits from make_limits
+    """
+    base = (VIPS_BASE_MEMORY_MB + limits["vips_cache_mb"]) * MB
+    if header is None:
+        # Unknown image: assume it needs the whole budget
+        return limits["memory_budget_mb"] * MB
+
+    if access == "random":
+        return base + decoded_size(header)
+
+    pixel_bytes = header["bands"] * BAND_FORMAT_BYTES.get(header["format"], 1)
+    rows = min(header["height"], SEQUENTIAL_WINDOW_ROWS)
+    window = header["width"] * rows * pixel_bytes
+    return base + window * max(1, limits["vips_concurrency"])
+
+
+def make_limits(
+    jobs=DEFAULT_JOBS,
+    memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+    vips_concurrency=DEFAULT_VIPS_CONCURRENCY,
+    vips_cache_mb=DEFAULT_VIPS_CACHE_MB,
+):
+    """Build the resource limits used by the image stage."""
+    return {
+        "jobs": max(1, jobs),
+        "memory_budget_mb": max(1, memory_budget_mb),
+        "vips_concurrency": max(1, vips_concurrency),
+        "vips_cache_mb": max(0, vips_cache_mb),
+    }
+
+
+def vips_options(limits):
+    """Get the vips command line options that cap cache and concurrency."""
+    return [
+        f"--vips-concurrency={limits['vips_concurrency']}",
+        f"--vips-cache-max-memory={limits['vips_cache_mb'] * MB}",
+    ]
+
+
+class MemoryBudget:
+    """A global memory budget shared by concurrent image jobs.
+
+    Jobs reserve their estimated peak memory before starting and release
+    it when done. A job larger than the whole budget waits until nothing
+    else is running, then runs alone.
+    """
+
+    def __init__(self, total_bytes):
+        self.total = total_bytes
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        nbytes = min(nbytes, self.total)
+        with self.cond:
+            while self.used + nbytes > self.total:
+                self.cond.wait()
+            self.used += nbytes
+        return nbytes
+
+    def release(self, nbytes):
+        with self.cond:
+            self.used -= nbytes
+            self.cond.notify_all()
+
+
+def generate_thumbnail(img_file, img_out_dir, orig_width, orig_height, limits=None):
     """Generate a single thumbnail for viewer previews.
 
     Creates: full/{width},{height}/0/default.jpg
@@ -61,6 +208,9 @@ def generate_thumbnail(img_file, img_out_dir, orig_width, orig_height):
     thumb_dir.mkdir(parents=True, exist_ok=True)
     thumb_output = thumb_dir / "default.jpg"
 
+    if limits is None:
+        limits = make_limits()
+
     try:
         subprocess.run(
             [
@@ -69,6 +219,7 @@ def generate_thumbnail(img_file, img_out_dir, orig_width, orig_height):
                 str(img_file),
                 str(thumb_output),
                 str(THUMBNAIL_SIZE),
+                *vips_options(limits),
             ],
             check=True,
             capture_output=True,
@@ -91,13 +242,153 @@ def ensure_images_dir(site_dir):
     return images_path
 
 
-def process_images(src_dir, dest_dir, base_url):
+def find_source_images(src_path):
+    """Find all source images under a directory, sorted by path."""
+    # Recursively find images
+    image_extensions = {".jpg", ".jpeg", ".png", ".tif", ".tiff"}
+
+    images = []
+    for img_file in sorted(src_path.rglob("*")):
+        if not img_file.is_file():
+            continue
+
+        if img_file.name.startswith("."):
+            continue
+
+        if img_file.suffix.lower() not in image_extensions:
+            continue
+
+        images.append(img_file)
+
+    return images
+
+
+def local_source_images(src_path):
+    """Find local source images with their paths relative to src_path.
+
+    Images that would tile into the same directory (e.g. 1.jpg and 1.png)
+    keep only the first by path.
+
+    Returns:
+        List of (image file, path relative to src_path)
+    """
+    images = []
+    seen = set()
+    for img_file in find_source_images(src_path):
+        rel_path = img_file.relative_to(src_path)
+        if rel_path.with_suffix("") in seen:
+            print(f"  Warning: Skipping {rel_path}, another image has the same id")
+            continue
+        seen.add(rel_path.with_suffix(""))
+        images.append((img_file, rel_path))
+    return images
+
+
+def local_image_ids(images):
+    """Get the image ids (rel_path without suffix) of local source images."""
+    return {rel_path.with_suffix("") for _, rel_path in images}
+
+
+def image_sources(src_dir):
+    """Map each image output directory to the source image it is tiled from.
+
+    Returns:
+        Dict mapping "images/{id_path}/" -> [source image path]
+    """
+    src_path = Path(src_dir)
+    if not src_path.exists():
+        return {}
+
+    local_images = local_source_images(src_path)
+
+    sources = {}
+    for img_file, rel_path in local_images:
+        id_path = (rel_path.parent / rel_path.stem).as_posix()
+        sources[f"images/{id_path}/"] = [img_file]
+
+    for entry in load_descriptors(src_path, local_image_ids(local_images)):
+        rel_path = entry["rel_path"]
+        id_path = (rel_path.parent / rel_path.stem).as_posix()
+        sources[f"images/{id_path}/"] = entry["urls"]
+    return sources
+
+
+def tile_image(img_file, rel_path, dest_path, base_url, header, access, limits):
+    """Tile a single source image into IIIF tiles and a thumbnail.
+
+    Args:
+        img_file: Path to the source image
+        rel_path: Path of the image relative to the source directory
+        dest_path: Site directory to output tiles to
+        base_url: Base URL for the deployment
+        header: Image header from get_image_header (or None if unknown)
+        access: vips access strategy, "sequential" or "random"
+        limits: Resource limits from make_limits
+    """
+    # Get path without suffix for the ID/Folder
+    id_path = rel_path.parent / rel_path.stem
+
+    print(f"Tiling {rel_path} ({access} access)...")
+    img_out_dir = dest_path / "images" / id_path
+    img_out_dir.parent.mkdir(parents=True, exist_ok=True)
+
+    cmd = [
+        "vips",
+        "dzsave",
+        f"{img_file}[access={access}]",
+        str(img_out_dir),
+        "--layout",
+        "iiif3",
+        "--id",
+        f"{base_url}/images/{id_path}",
+        *vips_options(limits),
+    ]
+
+    try:
+        subprocess.run(cmd, check=True)
+        print(f"Created tiles for {id_path}")
+
+        # Get original image dimensions
+        if header is None:
+            print(f"  Warning: Could not get dimensions for {img_file}")
+            orig_width, orig_height = 1000, 1000  # fallback
+        else:
+            orig_width, orig_height = header["width"], header["height"]
+
+        # Generate a thumbnail for viewer previews
+        generate_thumbnail(img_file, img_out_dir, orig_width, orig_height, limits)
+
+        # Fix the id in info.json
+        info_json_path = img_out_dir / "info.json"
+        if info_json_path.exists():
+            with open(info_json_path, "r") as f:
+                info_data = json.load(f)
+            # Set correct id without duplicated path segment
+            info_data["id"] = f"{base_url}/images/{id_path}"
+
+            with open(info_json_path, "w") as f:
+                json.dump(info_data, f, indent=2)
+
+    except subprocess.CalledProcessError as e:
+        print(f"Error tiling {id_path}: {e}")
+
+
+def process_images(src_dir, dest_dir, base_url, limits=None, fetch_options=None):
     """Process source images into IIIF tiles.
 
+    Local images under src_dir are tiled alongside remote images listed in
+    sources.json descriptors, which are fetched into a local cache first.
+
+    Jobs run concurrently up to limits["jobs"], but each job first reserves
+    its estimated peak memory (from the image header) against a global
+    budget, so the combined peak stays within limits["memory_budget_mb"].
+
     Args:
         src_dir: Directory containing source images
         dest_dir: Site directory to output tiles to
         base_url: Base URL for the deployment
+        limits: Resource limits from make_limits (defaults if None)
+        fetch_options: Fetch settings from make_fetch_options (defaults if None)
     """
     print("Processing images...")
 
@@ -111,70 +402,77 @@ def process_images(src_dir, dest_dir, base_url):
         print("No source images directory found.")
         return
 
+    if limits is None:
+        limits = make_limits()
+
     dest_path = Path(dest_dir)
     ensure_images_dir(dest_dir)
 
-    # Recursively find images
-    image_extensions = {".jpg", ".jpeg", ".png", ".tif", ".tiff"}
-
-    # We walk the directory
-    for img_file in src_path.rglob("*"):
-        if not img_file.is_file():
-            continue
-
-        if img_file.name.startswith("."):
-            continue
-
-        if img_file.suffix.lower() not in image_extensions:
-            continue
-
-        # Determine relative path from src_dir
-        rel_path = img_file.relative_to(src_path)
-
-        # Get path without suffix for the ID/Folder
-        id_path = rel_path.parent / rel_path.stem
-
-        print(f"Tiling {rel_path}...")
-        img_out_dir = dest_path / "images" / id_path
-        img_out_dir.parent.mkdir(parents=True, exist_ok=True)
-
-        cmd = [
-            "vips",
-            "dzsave",
-            str(img_file),
-            str(img_out_dir),
-            "--layout",
-            "iiif3",
-            "--id",
-            f"{base_url}/images/{id_path}",
-        ]
+    budget = MemoryBudget(limits["memory_budget_mb"] * MB)
 
+    def run_job(job):
+        img_file, rel_path = job
+        header = get_image_header(img_file)
+        access = choose_access(header)
+        estimate = estimate_job_memory(header, access, limits)
+        reserved = budget.acquire(estimate)
         try:
-            subprocess.run(cmd, check=True)
-            print(f"Created tiles for {id_path}")
-
-            # Get original image dimensions
-            orig_width, orig_height = get_image_dimensions(img_file)
-            if orig_width is None:
-                print(f"  Warning: Could not get dimensions for {img_file}")
-                orig_width, orig_height = 1000, 1000  # fallback
-
-            # Generate a thumbnail for viewer previews
-            generate_thumbnail(img_file, img_out_dir, orig_width, orig_height)
-
-            # Fix the id in info.json
-            info_json_path = img_out_dir / "info.json"
-            if info_json_path.exists():
-                with open(info_json_path, "r") as f:
-                    info_data = json.load(f)
-                # Set correct id without duplicated path segment
-                info_data["id"] = f"{base_url}/images/{id_path}"
+            tile_image(
+                img_file,
+                rel_path,
+                dest_path,
+                base_url,
+                header,
+                access,
+                limits,
+            )
+        finally:
+            budget.release(reserved)
+
+    # Local files take precedence over descriptor entries with the same id
+    images = local_source_images(src_path)
+    images += fetch_source_images(src_path, fetch_options, local_image_ids(images))
+    with ThreadPoolExecutor(max_workers=limits["jobs"]) as executor:
+        # Consume results so unexpected errors in a job are raised here
+        list(executor.map(run_job, images))
+
+
+def add_limit_arguments(parser):
+    """Add the image stage resource limit options to an argument parser."""
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help="Maximum number of images tiled concurrently",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=DEFAULT_MEMORY_BUDGET_MB,
+        help="Global memory budget for concurrent image jobs in MB",
+    )
+    parser.add_argument(
+        "--vips-concurrency",
+        type=int,
+        default=DEFAULT_VIPS_CONCURRENCY,
+        help="Worker threads per vips job",
+    )
+    parser.add_argument(
+        "--vips-cache",
+        type=int,
+        default=DEFAULT_VIPS_CACHE_MB,
+        help="Operation cache size per vips job in MB",
+    )
 
-                with open(info_json_path, "w") as f:
-                    json.dump(info_data, f, indent=2)
 
-        except subprocess.CalledProcessError as e:
-            print(f"Error tiling {id_path}: {e}")
+def limits_from_args(args):
+    """Build resource limits from parsed add_limit_arguments options."""
+    return make_limits(
+        jobs=args.jobs,
+        memory_budget_mb=args.memory_budget,
+        vips_concurrency=args.vips_concurrency,
+        vips_cache_mb=args.vips_cache,
+    )
 
 
 def main():
@@ -184,10 +482,27 @@ def main():
     parser.add_argument("--url", required=True, help="Base URL for the deployment")
     parser.add_argument("--src", default="src_images", help="Source images directory")
     parser.add_argument("--dest", default="_site", help="Destination site directory")
+    add_limit_arguments(parser)
+    add_fetch_arguments(parser)
+    add_previous_argument(parser)
     args = parser.parse_args()
 
     base_url = args.url.rstrip("/")
-    process_images(args.src, args.dest, base_url)
+
+    previous = previous_from_args(args)
+    inventory = BuildInventory(args.dest, base_url)
+
+    with inventory.stage("images", [args.src]):
+        process_images(
+            args.src,
+            args.dest,
+            base_url,
+            limits_from_args(args),
+            fetch_options_from_args(args),
+        )
+    inventory.add_sources(image_sources(args.src))
+
+    inventory.write(previous)
     print("Image processing complete.")
 
 
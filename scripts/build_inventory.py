@@ -0,0 +1,272 @@
+"""Build inventory for IIIF Test Manifests.
+
+This script records every file a build writes to the site directory (size,
+content hash, producing stage, source inputs and stage timing) and diffs it
+against the previous build, so deploys and viewer test suites can act on
+only what was added, changed or removed.
+Can be run standalone to diff two inventories or imported by the main build script.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Inventory and change log file names, written to the site directory
+INVENTORY_FILE = "build-manifest.json"
+CHANGES_FILE = "build-changes.json"
+
+
+def hash_file(path):
+    """Get the sha256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_site(site_dir):
+    """Get the size and mtime of every file in the site directory.
+
+    Returns:
+        Dict mapping path relative to site_dir -> (size, mtime_ns)
+    """
+    site_path = Path(site_dir)
+    files = {}
+    if not site_path.exists():
+        return files
+
+    for path in site_path.rglob("*"):
+        if not path.is_file():
+            continue
+        rel_path = path.relative_to(site_path).as_posix()
+        if rel_path in (INVENTORY_FILE, CHANGES_FILE):
+            continue
+        stat = path.stat()
+        files[rel_path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def load_inventory(path):
+    """Load a previously written inventory.
+
+    Returns:
+        The inventory dict, or None if missing, unreadable or not an inventory
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            inventory = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(inventory, dict) or not isinstance(
+        inventory.get("files"), dict
+    ):
+        return None
+    if not all(
+        isinstance(entry, dict) and "sha256" in entry
+        for entry in inventory["files"].values()
+    ):
+        return None
+    return inventory
+
+
+def diff_inventories(previous, current):
+    """List files added, changed or removed between two inventories.
+
+    Args:
+        previous: Previous inventory (or None for a first build)
+        current: Current inventory
+
+    Returns:
+        Dict with sorted "added", "changed" and "removed" path lists
+    """
+    old_files = previous["files"] if previous else {}
+    new_files = current["files"]
+
+    return {
+        "added": sorted(p for p in new_files if p not in old_files),
+        "changed": sorted(
+            p
+            for p in new_files
+            if p in old_files and new_files[p]["sha256"] != old_files[p]["sha256"]
+        ),
+        "removed": sorted(p for p in old_files if p not in new_files),
+    }
+
+
+def add_previous_argument(parser):
+    """Add the previous inventory option to an argument parser."""
+    parser.add_argument(
+        "--previous",
+        help=f"Previous build inventory to diff against "
+        f"(default: {INVENTORY_FILE} from the existing destination)",
+    )
+
+
+def previous_from_args(args):
+    """Load the previous inventory named by add_previous_argument options.
+
+    Falls back to the destination's own inventory, which may not exist yet.
+    An explicit --previous that can't be read as an inventory is an error,
+    since diffing against nothing would report every file as added.
+    """
+    if args.previous is None:
+        return load_inventory(Path(args.dest) / INVENTORY_FILE)
+
+    previous = load_inventory(args.previous)
+    if previous is None:
+        print(f"Could not read previous inventory {args.previous}")
+        sys.exit(1)
+    return previous
+
+
+class BuildInventory:
+    """Tracks the files produced by each stage of a build.
+
+    Wrap each stage in stage() and the files it creates or modifies are
+    attributed to it. Call write() once the build is finished.
+    """
+
+    def __init__(self, site_dir, base_url):
+        self.site_dir = Path(site_dir)
+        self.base_url = base_url
+        self.stages = {}
+        self.file_stages = {}
+        self.file_sources = {}
+
+    @contextmanager
+    def stage(self, name, inputs=()):
+        """Record the timing and output files of a build stage.
+
+        Args:
+            name: Stage name
+            inputs: Source paths the stage reads from
+        """
+        before = scan_site(self.site_dir)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            after = scan_site(self.site_dir)
+            outputs = [p for p, info in after.items() if before.get(p) != info]
+            for rel_path in outputs:
+                self.file_stages[rel_path] = name
+            self.stages[name] = {
+                "seconds": round(seconds, 3),
+                "inputs": sorted(str(p) for p in inputs),
+                "outputs": len(outputs),
+            }
+
+    def add_sources(self, sources):
+        """Record the source inputs of individual output files.
+
+        Args:
+            sources: Dict mapping output path (relative to the site dir, or a
+                directory prefix ending in "/") -> list of source paths
+        """
+        for rel_path, paths in sources.items():
+            self.file_sources[rel_path] = sorted(str(p) for p in paths)
+
+    def sources_for(self, rel_path):
+        """Get the source inputs of an output file, matching directory prefixes."""
+        if rel_path in self.file_sources:
+            return self.file_sources[rel_path]
+        for prefix, paths in self.file_sources.items():
+            if prefix.endswith("/") and rel_path.startswith(prefix):
+                return paths
+        return []
+
+    def build(self, previous=None):
+        """Build the inventory of every file currently in the site directory.
+
+        Files this build didn't produce (e.g. images kept from an earlier
+        build-images run) keep their stage and sources from the previous
+        inventory when their content is unchanged.
+        """
+        old_files = previous["files"] if previous else {}
+        files = {}
+        for rel_path, (size, _) in sorted(scan_site(self.site_dir).items()):
+            sha256 = hash_file(self.site_dir / rel_path)
+            stage = self.file_stages.get(rel_path)
+            old = old_files.get(rel_path)
+            if stage is None and old and old["sha256"] == sha256:
+                files[rel_path] = old
+                continue
+
+            files[rel_path] = {
+                "size": size,
+                "sha256": sha256,
+                "stage": stage,
+                "sources": self.sources_for(rel_path)
+                or self.stages.get(stage, {}).get("inputs", []),
+            }
+
+        stages = dict(previous.get("stages", {})) if previous else {}
+        stages.update(self.stages)
+
+        return {
+            "base_url": self.base_url,
+            "generated": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "stages": stages,
+            "files": files,
+        }
+
+    def write(self, previous=None):
+        """Write the inventory and the change log against a previous inventory.
+
+        Args:
+            previous: Previous inventory (or None for a first build)
+
+        Returns:
+            The change log dict
+        """
+        print(f"Writing {INVENTORY_FILE}...")
+        inventory = self.build(previous)
+        changes = diff_inventories(previous, inventory)
+        if previous and previous.get("base_url") != self.base_url:
+            print("  Note: base URL changed since the previous build")
+
+        (self.site_dir / INVENTORY_FILE).write_text(
+            json.dumps(inventory, indent=2), encoding="utf-8"
+        )
+        (self.site_dir / CHANGES_FILE).write_text(
+            json.dumps(changes, indent=2), encoding="utf-8"
+        )
+
+        print(
+            f"Generated {INVENTORY_FILE} ({len(inventory['files'])} files): "
+            f"{len(changes['added'])} added, {len(changes['changed'])} changed, "
+            f"{len(changes['removed'])} removed"
+        )
+        return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Diff two IIIF Test Manifests build inventories"
+    )
+    parser.add_argument("previous", help="Previous build-manifest.json")
+    parser.add_argument("current", help="Current build-manifest.json")
+    args = parser.parse_args()
+
+    inventories = []
+    for path in (args.previous, args.current):
+        inventory = load_inventory(path)
+        if inventory is None:
+            print(f"Could not read inventory {path}")
+            sys.exit(1)
+        inventories.append(inventory)
+
+    changes = diff_inventories(*inventories)
+    print(json.dumps(changes, indent=2))
+
+
+if __name__ == "__main__":
+    main()
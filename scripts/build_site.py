@@ -5,17 +5,27 @@ Can be run standalone or imported by the main build script.
 """
 
 import argparse
+import json
 import shutil
 import sys
+from functools import lru_cache
 from pathlib import Path
 
 # Ensure the root directory is in the path so we can import manifests
 sys.path.append(str(Path.cwd()))
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from manifests.registry import MANIFESTS
 from manifests.collections import top
 
+from build_inventory import BuildInventory, add_previous_argument, previous_from_args
+
+# Number of manifests rendered per category page
+INDEX_PAGE_SIZE = 50
+
+# Where compiled template bytecode is cached between builds
+TEMPLATE_CACHE_DIR = Path(".cache") / "jinja"
+
 
 def ensure_site_dirs(site_dir):
     """Ensure the site directory structure exists."""
@@ -28,6 +38,37 @@ def ensure_site_dirs(site_dir):
     return site_path
 
 
+def manifest_sources():
+    """Map each generated manifest to the module that defines it.
+
+    Returns:
+        Dict mapping "manifests/{rel_path}" -> [module source path]
+    """
+    sources = {}
+    for rel_path, loader_func in MANIFESTS.items():
+        module = sys.modules.get(loader_func.__module__)
+        module_file = getattr(module, "__file__", None)
+        if module_file:
+            try:
+                module_file = Path(module_file).relative_to(Path.cwd())
+            except ValueError:
+                pass
+            sources[f"manifests/{rel_path}"] = [Path(module_file).as_posix()]
+    return sources
+
+
+def clean_site_outputs(site_dir):
+    """Remove the outputs this script owns, leaving images in place.
+
+    Manifests, collections and category pages are regenerated from scratch so
+    nothing removed from the registry lingers in the site directory.
+    """
+    site_path = Path(site_dir)
+    for name in ("manifests", "collections", "categories"):
+        if (site_path / name).exists():
+            shutil.rmtree(site_path / name)
+
+
 def process_manifests(dest_dir, base_url):
     """Generate all manifests from the registry.
 
@@ -111,28 +152,145 @@ def process_manifests(dest_dir, base_url):
     return manifests_list
 
 
-def generate_index(manifests, dest_dir, template_dir, base_url):
-    """Generate the index.html and copy static files.
+@lru_cache(maxsize=None)
+def get_template_env(template_dir):
+    """Get a Jinja environment for a template directory.
+
+    The environment is created once per directory and compiled templates are
+    kept in a bytecode cache on disk, so repeated renders (and repeated
+    builds) skip parsing and compiling the templates again.
+    """
+    TEMPLATE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return Environment(
+        loader=FileSystemLoader(template_dir),
+        bytecode_cache=FileSystemBytecodeCache(str(TEMPLATE_CACHE_DIR)),
+        auto_reload=False,
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+
+
+def category_slug(category):
+    """Get a filesystem-safe slug for a category name."""
+    if category in ("", "."):
+        return "root"
+    return category.replace("/", "-")
+
+
+def group_by_category(manifests):
+    """Group manifests by category, sorted by category then label."""
+    categories = {}
+    for m in manifests:
+        categories.setdefault(m["category"], []).append(m)
+
+    return {
+        cat: sorted(categories[cat], key=lambda m: m["label"])
+        for cat in sorted(categories)
+    }
+
+
+def paginate(items, page_size):
+    """Split a list of items into pages of at most page_size items."""
+    if page_size <= 0:
+        return [items]
+    return [items[i : i + page_size] for i in range(0, len(items), page_size)] or [[]]
+
+
+def write_search_index(categories, dest_dir):
+    """Write a compact search index of manifest labels and summaries.
+
+    Each entry is a list of [path, label, summary, category] so the index
+    page can filter every manifest client-side without rendering them all.
+    """
+    entries = [
+        [m["path"], m["label"], m["summary"], cat]
+        for cat, items in categories.items()
+        for m in items
+    ]
+    index_path = Path(dest_dir) / "search-index.json"
+    index_path.write_text(
+        json.dumps(entries, ensure_ascii=False, separators=(",", ":")),
+        encoding="utf-8",
+    )
+    print(f"Generated search-index.json ({len(entries)} entries)")
+
+
+def generate_category_pages(
+    category, items, dest_dir, template_dir, base_url, page_size
+):
+    """Render the paginated listing pages for a single category.
+
+    Creates: categories/{slug}/{page}.html
+
+    Returns:
+        Number of pages written
+    """
+    template = get_template_env(template_dir).get_template("category.html")
+    slug = category_slug(category)
+    pages = paginate(items, page_size)
+
+    # Remove pages left over from a previous build with more pages
+    cat_dir = Path(dest_dir) / "categories" / slug
+    if cat_dir.exists():
+        shutil.rmtree(cat_dir)
+    cat_dir.mkdir(parents=True)
+
+    for page_num, page_items in enumerate(pages, start=1):
+        output = template.render(
+            category=category,
+            slug=slug,
+            items=page_items,
+            page=page_num,
+            num_pages=len(pages),
+            total=len(items),
+            BASE_URL=base_url,
+        )
+        (cat_dir / f"{page_num}.html").write_text(output, encoding="utf-8")
+
+    return len(pages)
+
+
+def generate_index(
+    manifests, dest_dir, template_dir, base_url, page_size=INDEX_PAGE_SIZE
+):
+    """Generate the index.html, category pages, search index and static files.
+
+    The index page only renders the first page of each category; the full
+    listing lives in paginated category pages, and search-index.json lets the
+    index filter across all manifests client-side.
 
     Args:
         manifests: List of manifest metadata
         dest_dir: Site directory to output to
         template_dir: Directory containing templates
         base_url: Base URL for the deployment
+        page_size: Number of manifests per category page
     """
     print("Generating index.html...")
-    env = Environment(loader=FileSystemLoader(template_dir))
-    template = env.get_template("index.html")
-
-    # Group by category
-    categories = {}
-    for m in manifests:
-        cat = m["category"]
-        if cat not in categories:
-            categories[cat] = []
-        categories[cat].append(m)
-
-    output = template.render(categories=categories, BASE_URL=base_url)
+    template = get_template_env(template_dir).get_template("index.html")
+
+    categories = group_by_category(manifests)
+
+    summaries = []
+    for cat, items in categories.items():
+        num_pages = generate_category_pages(
+            cat, items, dest_dir, template_dir, base_url, page_size
+        )
+        summaries.append(
+            {
+                "name": cat,
+                "slug": category_slug(cat),
+                "first_page": paginate(items, page_size)[0],
+                "total": len(items),
+                "num_pages": num_pages,
+            }
+        )
+
+    write_search_index(categories, dest_dir)
+
+    output = template.render(
+        categories=summaries, search_limit=page_size, BASE_URL=base_url
+    )
 
     (Path(dest_dir) / "index.html").write_text(output, encoding="utf-8")
 
@@ -152,13 +310,32 @@ def main():
     parser.add_argument("--url", required=True, help="Base URL for the deployment")
     parser.add_argument("--dest", default="_site", help="Destination site directory")
     parser.add_argument("--templates", default="templates", help="Templates directory")
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=INDEX_PAGE_SIZE,
+        help="Manifests per category page",
+    )
+    add_previous_argument(parser)
     args = parser.parse_args()
 
     base_url = args.url.rstrip("/")
 
+    # Read the previous inventory before any outputs are cleaned
+    previous = previous_from_args(args)
+
+    clean_site_outputs(args.dest)
     ensure_site_dirs(args.dest)
-    manifests = process_manifests(args.dest, base_url)
-    generate_index(manifests, args.dest, args.templates, base_url)
+    inventory = BuildInventory(args.dest, base_url)
+
+    with inventory.stage("manifests", ["manifests"]):
+        manifests = process_manifests(args.dest, base_url)
+    inventory.add_sources(manifest_sources())
+
+    with inventory.stage("index", [args.templates]):
+        generate_index(manifests, args.dest, args.templates, base_url, args.page_size)
+
+    inventory.write(previous)
 
     print("Site generation complete.")
 
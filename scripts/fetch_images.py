@@ -0,0 +1,315 @@
+"""Remote source image fetching for IIIF Test Manifests.
+
+Large source images don't need to be committed to the repository. Instead a
+sources.json descriptor anywhere under the source images directory lists
+them by URL and sha256:
+
+    {
+        "images": [
+            {
+                "name": "001-r_Deuteronomy.jpg",
+                "urls": ["https://example.org/aleppo/001-r_Deuteronomy.jpg"],
+                "sha256": "..."
+            }
+        ]
+    }
+
+Each image is tiled as if it were {descriptor dir}/{name}. Files are fetched
+concurrently into an on-disk cache keyed by hash, so later builds (and
+offline builds) reuse them without downloading again.
+Can be run standalone to warm the cache or imported by the image build script.
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import re
+import shutil
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from build_inventory import hash_file
+
+# Descriptor file name looked for under the source images directory
+DESCRIPTOR_FILE = "sources.json"
+
+# Default fetch settings
+DEFAULT_CACHE_DIR = Path(".cache") / "src_images"
+DEFAULT_CONNECTIONS = 4
+DEFAULT_TIMEOUT = 60
+
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def make_fetch_options(
+    cache_dir=DEFAULT_CACHE_DIR,
+    connections=DEFAULT_CONNECTIONS,
+    mirror=None,
+    offline=False,
+    timeout=DEFAULT_TIMEOUT,
+):
+    """Build the settings used to fetch remote source images.
+
+    Args:
+        cache_dir: Directory fetched images are cached in
+        connections: Maximum number of concurrent downloads
+        mirror: Base URL of a local mirror, tried before the listed URLs
+        offline: Only use the cache, never download
+        timeout: Per-request timeout in seconds
+    """
+    return {
+        "cache_dir": Path(cache_dir),
+        "connections": max(1, connections),
+        "mirror": mirror.rstrip("/") if mirror else None,
+        "offline": offline,
+        "timeout": timeout,
+    }
+
+
+def load_descriptors(src_path, exclude=()):
+    """Load every source descriptor under the source images directory.
+
+    Args:
+        src_path: Directory containing source images and descriptors
+        exclude: Image ids (rel_path without suffix) already provided by
+            local files, which descriptor entries must not replace
+
+    Returns:
+        List of entry dicts with name, urls, sha256 and rel_path (the path
+        the image is tiled as, relative to the source images directory)
+    """
+    entries = []
+    seen = set(exclude)
+    for descriptor in sorted(src_path.rglob(DESCRIPTOR_FILE)):
+        rel_dir = descriptor.parent.relative_to(src_path)
+        try:
+            with open(descriptor, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading {descriptor}: {e}")
+            continue
+
+        images = data.get("images", []) if isinstance(data, dict) else None
+        if not isinstance(images, list):
+            print(f"Error reading {descriptor}: expected an object with an images list")
+            continue
+
+        for image in images:
+            if not isinstance(image, dict):
+                print(f"  Warning: Skipping invalid entry in {descriptor}")
+                continue
+            urls = image.get("urls") or ([image["url"]] if "url" in image else [])
+            name = image.get("name")
+            sha256 = str(image.get("sha256", "")).lower()
+            if not isinstance(urls, list) or not all(
+                isinstance(url, str) for url in urls
+            ):
+                print(f"  Warning: Skipping entry with invalid urls in {descriptor}")
+                continue
+            # The name must be a plain filename so the image stays in rel_dir
+            if (
+                not isinstance(name, str)
+                or not name
+                or Path(name).name != name
+                or name in (".", "..")
+            ):
+                print(f"  Warning: Skipping entry with invalid name in {descriptor}")
+                continue
+            if not SHA256_PATTERN.fullmatch(sha256):
+                print(f"  Warning: Skipping entry with invalid sha256 in {descriptor}")
+                continue
+
+            # Two images with the same id would be tiled into the same directory
+            rel_path = rel_dir / name
+            if rel_path.with_suffix("") in seen:
+                print(
+                    f"  Warning: Skipping {rel_path} in {descriptor}, "
+                    "another source image has the same id"
+                )
+                continue
+            seen.add(rel_path.with_suffix(""))
+
+            entries.append(
+                {
+                    "name": name,
+                    "urls": urls,
+                    "sha256": sha256,
+                    "rel_path": rel_path,
+                }
+            )
+    return entries
+
+
+def cache_path(entry, options):
+    """Get the cache location of an entry, keyed by its hash."""
+    return options["cache_dir"] / f"{entry['sha256']}{Path(entry['name']).suffix}"
+
+
+def candidate_urls(entry, options):
+    """Get the URLs to try for an entry, local mirror first."""
+    urls = list(entry["urls"])
+    if options["mirror"]:
+        urls.insert(0, f"{options['mirror']}/{entry['rel_path'].as_posix()}")
+    return urls
+
+
+def download(url, target, timeout):
+    """Download a URL to a file (blocking)."""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        with open(target, "wb") as f:
+            shutil.copyfileobj(response, f, 1024 * 1024)
+
+
+async def fetch_entry(entry, options, semaphore):
+    """Fetch a single entry into the cache, verifying its hash.
+
+    Returns:
+        Path to the cached file, or None if it could not be fetched
+    """
+    target = cache_path(entry, options)
+    if target.exists():
+        if await asyncio.to_thread(hash_file, target) == entry["sha256"]:
+            return target
+        print(f"  Warning: Cached {entry['rel_path']} failed hash check, refetching")
+        target.unlink()
+
+    if options["offline"]:
+        print(f"  Warning: {entry['rel_path']} is not cached (offline)")
+        return None
+
+    partial = target.with_name(target.name + ".part")
+    for url in candidate_urls(entry, options):
+        try:
+            async with semaphore:
+                try:
+                    await asyncio.to_thread(
+                        download, url, partial, options["timeout"]
+                    )
+                except (OSError, ValueError, http.client.HTTPException) as e:
+                    print(f"  Warning: Failed to fetch {url}: {e}")
+                    continue
+
+            if await asyncio.to_thread(hash_file, partial) != entry["sha256"]:
+                print(f"  Warning: {url} failed hash check")
+                continue
+
+            partial.replace(target)
+            print(f"Fetched {entry['rel_path']}")
+            return target
+        finally:
+            partial.unlink(missing_ok=True)
+
+    print(f"Error fetching {entry['rel_path']}: no URL succeeded")
+    return None
+
+
+async def fetch_all(entries, options):
+    """Fetch entries concurrently with at most options["connections"] downloads.
+
+    Entries sharing a cache file (the same image listed twice) are fetched once.
+    """
+    # Downloads block a worker thread each, so size the pool to match
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=options["connections"])
+    )
+    semaphore = asyncio.Semaphore(options["connections"])
+    unique = {}
+    for entry in entries:
+        unique.setdefault(cache_path(entry, options), entry)
+
+    paths = await asyncio.gather(
+        *(fetch_entry(entry, options, semaphore) for entry in unique.values())
+    )
+    fetched = dict(zip(unique, paths))
+    return [fetched[cache_path(entry, options)] for entry in entries]
+
+
+def fetch_source_images(src_dir, options=None, exclude=()):
+    """Fetch every remote source image listed under the source images directory.
+
+    Args:
+        src_dir: Directory containing source images and descriptors
+        options: Fetch settings from make_fetch_options (defaults if None)
+        exclude: Image ids already provided by local files (see load_descriptors)
+
+    Returns:
+        List of (cached file, path relative to src_dir) for fetched images
+    """
+    src_path = Path(src_dir)
+    if not src_path.exists():
+        return []
+
+    entries = load_descriptors(src_path, exclude)
+    if not entries:
+        return []
+
+    if options is None:
+        options = make_fetch_options()
+
+    print(f"Fetching {len(entries)} remote source images...")
+    options["cache_dir"].mkdir(parents=True, exist_ok=True)
+    paths = asyncio.run(fetch_all(entries, options))
+
+    return [
+        (path, entry["rel_path"])
+        for entry, path in zip(entries, paths)
+        if path is not None
+    ]
+
+
+def add_fetch_arguments(parser):
+    """Add the remote source image options to an argument parser."""
+    parser.add_argument(
+        "--image-cache",
+        default=str(DEFAULT_CACHE_DIR),
+        help="Cache directory for fetched source images",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=DEFAULT_CONNECTIONS,
+        help="Maximum concurrent source image downloads",
+    )
+    parser.add_argument(
+        "--mirror", help="Base URL of a local mirror of the source images"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use cached source images, never download",
+    )
+    parser.add_argument(
+        "--fetch-timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="Timeout in seconds for each source image request",
+    )
+
+
+def fetch_options_from_args(args):
+    """Build fetch settings from parsed add_fetch_arguments options."""
+    return make_fetch_options(
+        cache_dir=args.image_cache,
+        connections=args.connections,
+        mirror=args.mirror,
+        offline=args.offline,
+        timeout=args.fetch_timeout,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fetch remote source images for IIIF Test Manifests"
+    )
+    parser.add_argument("--src", default="src_images", help="Source images directory")
+    add_fetch_arguments(parser)
+    args = parser.parse_args()
+
+    fetched = fetch_source_images(args.src, fetch_options_from_args(args))
+    print(f"Fetch complete ({len(fetched)} images cached).")
+
+
+if __name__ == "__main__":
+    main()